@@ -4,14 +4,51 @@ An extensible RPN calculator for the command line.
 """
 
 import os
+import re
 import sys
+import weakref
+from functools import lru_cache
 
 import rpn_calc
 
 
+# ANSI escape sequence to clear the screen and move the cursor home
+CLEAR_SCREEN = '\x1b[2J\x1b[H'
+
+
+def enable_ansi():
+    """
+    Make the terminal interpret ANSI escape sequences, if needed.
+
+    Returns True if escape sequences can be used. POSIX terminals support
+    them; Windows consoles need virtual terminal processing to be enabled,
+    which is not available on older versions.
+    """
+    if os.name != 'nt':
+        return True
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+        return bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004))
+    except (ImportError, AttributeError, OSError):
+        return False
+
+
+ansi_enabled = enable_ansi()
+
+
 def clear_screen():
     """Clear all screen contents."""
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if ansi_enabled:
+        sys.stdout.write(CLEAR_SCREEN)
+        sys.stdout.flush()
+    else:  # fall back to the shell for consoles without escape sequences
+        os.system('cls')
 
 
 def pause():
@@ -38,8 +75,7 @@ def show_error(e, interactive):
 def show_operators(c):
     """Print a list of operators registered in the calculator."""
     print("Available Operators\nopcode (arity): description\n")
-    for op in c.operators:
-        print(f'{op.opcode} ({op.arity}): {op.description} [{op.plugin}]')
+    print(c.render_operators())
     print()
     pause()
 
@@ -82,28 +118,40 @@ def clear_stack(calculator):
 
 
 def update_stack(stack):
-    """Refresh the screen with the current contents of the stack."""
-    clear_screen()
-    print("STACK:")
+    """
+    Refresh the screen with the current contents of the stack.
+
+    The whole screen is written at once, including the escape sequence to
+    clear it if the terminal supports it.
+    """
+    if ansi_enabled:
+        buf = [CLEAR_SCREEN]
+    else:
+        clear_screen()
+        buf = []
+    buf.append('STACK:\n')
     if not stack:
-        print('Empty stack\n')
-        return
-    stacksize = len(stack)
-    for value, position in zip(stack, range(stacksize, 0, -1)):
-        print(f'{position}: {value}')
-    print()
+        buf.append('Empty stack\n')
+    else:
+        stacksize = len(stack)
+        buf.extend(f'{position}: {value}\n'
+                   for value, position in zip(stack, range(stacksize, 0, -1)))
+    buf.append('\n')
+    sys.stdout.write(''.join(buf))
 
 
 def load_plugin(c):
     """Prompt the user for an extension file name and load it."""
     plugin = input('Enter plugin name: ')
     c.load_plugin(plugin)
+    update_dispatch(c)
 
 
 def unload_plugin(c):
     """Prompt the user for an extension file name and unload it."""
     plugin = input('Enter plugin name: ')
     c.unload_plugin(plugin)
+    update_dispatch(c)
 
 
 def quit(c=None):
@@ -137,6 +185,45 @@ ui_commands = {
 }
 
 
+# Kinds of commands produced by parse_lazy() and parse_batch(), also used in the dispatch table
+KIND_OP = 0
+KIND_UI = 1
+KIND_NUMBER = 2
+KIND_STACKSIZE = 3
+KIND_ERROR = 4
+
+# Dispatch table of each calculator: maps every known token to a (kind, command) tuple, so that
+# parsing only needs one lookup per token; it depends on the operators registered in the
+# calculator, so it must be rebuilt with update_dispatch() whenever plugins are loaded or unloaded
+dispatch_tables = weakref.WeakKeyDictionary()
+
+
+def update_dispatch(calculator):
+    """
+    Rebuild the dispatch table for the operators registered in calculator.
+
+    UI commands take precedence over operators, and aliases over both;
+    aliases are resolved here to the entry of the command they stand for.
+    Aliases for operators that are not registered (e.g. after unloading a
+    plugin that overrode them) are left out, so they are reported as
+    unknown commands.
+    """
+    table = {sys.intern(op.opcode): (KIND_OP, op.opcode) for op in calculator.operators}
+    table.update((cmd, (KIND_UI, cmd)) for cmd in ui_commands)
+    table['stacksize'] = KIND_STACKSIZE, 'stacksize'  # see comment in ui_commands
+    table.update((alias, table[cmd]) for alias, cmd in aliases.items() if cmd in table)
+    # Update in place, so that commands still being parsed see the new operators
+    calculator_table = dispatch_tables.setdefault(calculator, {})
+    calculator_table.clear()
+    calculator_table.update(table)
+
+
+# Plain decimal literals, which float() is known to accept, and complex literal candidates
+_NUM_RE = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+_CPLX_RE = re.compile(r'^\(|[jJ]\)?$')
+
+
+@lru_cache(maxsize=1024)
 def convert(txt):
     """
     Convert numeric elements to float or complex if possible.
@@ -146,65 +233,90 @@ def convert(txt):
     If txt can be converted into a number, return success = True and the
     converted value in value. Otherwise return success = False, and value
     contains the input argument.
+
+    Plain decimal literals skip the try/except conversions, and complex()
+    is only tried on candidates ending in j or in parentheses, such as
+    '(1)'; results are memoized, as scripts tend to repeat the same
+    literals.
     """
+    if _NUM_RE.fullmatch(txt):
+        return True, float(txt)
     try:
-        res = float(txt)
+        res = float(txt)  # other forms, such as 'inf' or '1_000'
         return True, res
     except:
         pass
-    try:
-        res = complex(txt)
-        return True, res
-    except:
-        return False, txt
+    if _CPLX_RE.search(txt):
+        try:
+            res = complex(txt)
+            return True, res
+        except:
+            pass
+    return False, txt
 
 
-def parse(commands, calculator, interactive=True):
+def parse_batch(commands, calculator, interactive=False):
     """
     Process a sequence of commands.
 
     Inputs:
     -   commands: the sequence of commands to process
-    -   calculator: the RPNCalculator instance for which to process it (the
-        available operators are checked against this)
+    -   calculator: the RPNCalculator instance for which to process it; its
+        dispatch table must have been built with update_dispatch
     -   interactive: a Boolean specifying whether the calculator is running
         in interactive mode (True) or in CLI mode (False)
 
-    Returns a generator that iterates over the processed commands. Aliases
-    are translated to the corresponding commands (which are assumed to
-    exist, otherwise the alias shouldn't be there). UI commands are yielded
-    as-is in interactive mode, and ignored in CLI mode. If a command
-    matches the opcode of an operator in calculator, the command is
-    yielded. Anything else is yielded as a number if it can be converted,
-    otherwise an error is reported, but nothing is yielded.
+    Returns a list of the processed commands as (kind, command) tuples,
+    kind being one of the KIND_* constants. Aliases are translated to the
+    corresponding commands, unless those are not registered, in which case
+    the alias is an unknown command (see update_dispatch). UI commands are
+    included as-is in interactive mode, and ignored in CLI mode. If a
+    command matches the opcode of an operator in calculator, the command
+    is included. Anything else is included as a number if it can be
+    converted; otherwise, the last item is (KIND_ERROR, error message).
+
+    All commands are processed at once, which is faster when all of them
+    are going to be run anyway, as in CLI mode.
     """
-    if not commands:  # Empty command is alias for 'dup'
-        yield 'dup'
-        return
-
+    lookup = dispatch_tables[calculator].get
+    local_convert = convert
+    processed = []
+    append = processed.append
     for command in commands:
-        if command in aliases:
-            yield aliases[command]
-        elif command in ui_commands:
-            if interactive:
-                yield command
-        elif command in calculator._operators:
-            yield command
-        else:
-            success, number = convert(command)
+        entry = lookup(command)
+        if entry is None:
+            success, number = local_convert(command)
             if success:
-                yield number
+                append((KIND_NUMBER, number))
                 continue
-            show_error(f"Unknown command '{command}'", interactive)
+            append((KIND_ERROR, f"Unknown command '{command}'"))
             break
+        if interactive or entry[0] == KIND_OP:
+            append(entry)
+    return processed
+
+
+def parse_lazy(commands, calculator, interactive=True):
+    """
+    Process a sequence of commands one by one.
+
+    Same as parse_batch, but returns a generator, and each command is only
+    processed when it is reached; so commands after a 'load' or 'unload'
+    are processed against the operators registered at that point.
+    """
+    for command in commands:
+        processed = parse_batch((command,), calculator=calculator, interactive=interactive)
+        yield from processed
+        if processed and processed[-1][0] == KIND_ERROR:
+            return
 
 
 def run_command(cmd, calculator, interactive):
     """
-    Run a command in calculator.
+    Run an operator in calculator.
 
     Inputs:
-    -   command: the command to run
+    -   command: the opcode of the operator to run
     -   calculator: the RPNCalculator instance
     -   interactive: a Boolean specifying whether the calculator is running
         in interactive mode (True) or in CLI mode (False)
@@ -213,10 +325,6 @@ def run_command(cmd, calculator, interactive):
     otherwise. In case of error, the error is printed to the screen
     before returning.
     """
-    if cmd in ui_commands:
-        if interactive:  # ignore UI commands in non-interactive mode
-            ui_commands[cmd]['function'](calculator)
-        return None
     e = calculator.run_command(cmd)
     if e is not None:
         show_error(e, interactive)
@@ -224,27 +332,90 @@ def run_command(cmd, calculator, interactive):
     return None
 
 
+def compile_scalar_program(cmds, calculator):
+    """
+    Prepare a parsed command sequence to be run by run_scalar_program.
+
+    This is only possible if cmds consists only of numbers and of unary or
+    binary operators declared to return a single value (RESULT_SCALAR),
+    which do not return error messages, and if no operator needs more
+    arguments than are available in calculator's stack at that point.
+
+    Returns a list of (arity, function) steps, numbers being steps of
+    arity 0 with the number instead of the function; or None if cmds
+    cannot be run this way.
+    """
+    operators = calculator._operators
+    depth = len(calculator.stack)
+    steps = []
+    for kind, cmd in cmds:
+        if kind == KIND_NUMBER:
+            steps.append((0, cmd))
+            depth += 1
+            continue
+        if kind != KIND_OP:
+            return None
+        op = operators[cmd]
+        if op.result_kind != rpn_calc.RESULT_SCALAR or op.arity not in (1, 2) or depth < op.arity:
+            return None
+        steps.append((op.arity, op.function))
+        depth -= op.arity - 1
+    return steps
+
+
+def run_scalar_program(steps, stack):
+    """
+    Run the steps prepared by compile_scalar_program on stack.
+
+    The operator functions are called directly in a single loop, as the
+    checks done by RPNCalculator.run_command are known to be unnecessary.
+    Exceptions raised by the operator functions (e.g. ZeroDivisionError
+    from '5 0 mod') still propagate, as they do with run_command.
+    """
+    push, pop = stack.append, stack.pop
+    for arity, item in steps:
+        if arity == 2:
+            y = pop()
+            push(item(pop(), y))
+        elif arity == 1:
+            push(item(pop()))
+        else:
+            push(item)
+
+
 def main_interactive(c):
     """
     Run the calculator application in interactive mode.
 
     Takes as argument an RPNCalculator instace to use as calculator engine.
     """
-    stack = []
     stack_size = 4
+    stack = c.read_stack_view(stack_size)
 
     while True:
+        # The screen is redrawn after every line, as UI commands, prompts and errors leave their
+        # output on it; but the stack is only read again if anything may have changed it
         update_stack(stack)
-        cmds = parse(input().strip().split(), calculator=c)
-        for cmd in cmds:
-            if cmd == 'stacksize':  # Special case: changes a local variable
+        line = input().strip()
+        commands = line.split() if line else ('dup',)  # Empty command is alias for 'dup'
+        cmds = parse_lazy(commands, calculator=c)
+        dirty = False
+        for kind, cmd in cmds:
+            if kind == KIND_NUMBER:
+                c.stack.append(cmd)
+            elif kind == KIND_OP:
+                if run_command(cmd, calculator=c, interactive=True) is not None:
+                    break
+            elif kind == KIND_UI:
+                ui_commands[cmd]['function'](c)
+            elif kind == KIND_STACKSIZE:  # Special case: changes a local variable
                 stack_size = get_new_stack_size(old_stack_size=stack_size)
-                e = None
-                continue
-            e = run_command(cmd, calculator=c, interactive=True)
-            if e is not None:
+            else:  # KIND_ERROR
+                show_error(cmd, interactive=True)
                 break
-        stack = c.read_stack(stack_size)
+            dirty = True
+        if dirty:
+            stack = c.read_stack_view(stack_size)
 
 
 def main_cli(c, cli_cmds):
@@ -257,11 +428,23 @@ def main_cli(c, cli_cmds):
     stdout (bottom to top). In case of error, the error is reported to
     stderr and nothing output to stdout.
     """
-    cmds = parse(cli_cmds, calculator=c, interactive=False)
-    for cmd in cmds:
-        e = run_command(cmd, calculator=c, interactive=False)
-        if e is not None:
-            break
+    e = None
+    cmds = parse_batch(cli_cmds, calculator=c, interactive=False)
+    program = compile_scalar_program(cmds, calculator=c)
+    if program is not None:  # Fast path for plain arithmetic, without error messages
+        run_scalar_program(program, stack=c.stack)
+    else:
+        for kind, cmd in cmds:  # only numbers, operators and errors in CLI mode
+            if kind == KIND_NUMBER:
+                c.stack.append(cmd)
+                continue
+            if kind == KIND_ERROR:
+                show_error(cmd, interactive=False)
+                e = cmd
+                break
+            e = run_command(cmd, calculator=c, interactive=False)
+            if e is not None:
+                break
 
     if e is None:
         status_code = 0
@@ -277,15 +460,19 @@ def main():
     Run the calculator aplication.
 
     Set up the calculator engine and run CLI mode if there are arguments
-    in the call, or interactive mode otherwise.
+    in the call, or if commands are piped through stdin; or interactive
+    mode otherwise.
     """
     c = rpn_calc.RPNCalculator()
     c.load_plugin('extra_ops')
+    update_dispatch(c)
 
-    if len(sys.argv) == 1:
-        main_interactive(c)
+    if len(sys.argv) > 1:
+        main_cli(c, cli_cmds=sys.argv[1:])
+    elif sys.stdin is not None and not sys.stdin.isatty():
+        main_cli(c, cli_cmds=sys.stdin.read().split())
     else:
-        main_cli(c, cli_cmds=sys.argv[1:])        
+        main_interactive(c)
 
 
 if __name__ == '__main__':
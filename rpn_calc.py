@@ -4,15 +4,29 @@ define new operators to extend the calculator.
 """
 
 
+import importlib
+import os
+import sys
 from collections import namedtuple
 from operator import add, sub, mul
 
 
-Operator = namedtuple('Operator', ['opcode', 'arity', 'function', 'description', 'plugin'])
+# Kinds of results returned by operator functions
+RESULT_SCALAR = 0  # always a single value
+RESULT_LIST = 1  # always a list of values
+RESULT_CHECKED = 2  # a single value, or an error message
+RESULT_NONE = 3  # always None
+RESULT_ANY = 4  # any of the above, only known at run time
+
+
+Operator = namedtuple('Operator',
+                      ['opcode', 'arity', 'function', 'description', 'plugin', 'result_kind'],
+                      defaults=[RESULT_ANY])
 Operator.__doc__ = """
     An operator to extend RPNCalculator.
 
-    Operator('opcode', 'arity', 'function', 'description', 'plugin')
+    Operator('opcode', 'arity', 'function', 'description', 'plugin',
+             'result_kind' (optional, defaults to RESULT_ANY))
 
     *   opcode is the string that will be used as identifier for the
         operator.
@@ -32,25 +46,160 @@ Operator.__doc__ = """
     *   plugin is the name of the plugin that loads the operator; it is
         only an identifier to group operators for the unload_plugin
         functionality
+
+    *   result_kind is one of the RESULT_* constants, telling what
+        function returns; declaring it lets the calculator skip checking
+        the type of each result. The default, RESULT_ANY, is always safe.
 """
 
 
 _std_operators = [
-    Operator(opcode='+', arity=2, function=add, description='addition', plugin='std'),
-    Operator(opcode='-', arity=2, function=sub, description='addition', plugin='std'),
-    Operator(opcode='*', arity=2, function=mul, description='addition', plugin='std'),
+    Operator(opcode='+', arity=2, function=add, description='addition', plugin='std',
+             result_kind=RESULT_SCALAR),
+    Operator(opcode='-', arity=2, function=sub, description='addition', plugin='std',
+             result_kind=RESULT_SCALAR),
+    Operator(opcode='*', arity=2, function=mul, description='addition', plugin='std',
+             result_kind=RESULT_SCALAR),
     Operator(opcode='/', arity=2,
              function=lambda x, y: x/y if y != 0 else 'error: division by zero',
-             description='division', plugin='std'),
+             description='division', plugin='std', result_kind=RESULT_CHECKED),
     Operator(opcode='drop', arity=1, function=lambda x: None,
-             description='pop and lose element on top level of stack', plugin='std'),
+             description='pop and lose element on top level of stack', plugin='std',
+             result_kind=RESULT_NONE),
     Operator(opcode='swap', arity=2, function=lambda x,y: [y, x],
-             description='swap the two topmost elements of stack', plugin='std'),
+             description='swap the two topmost elements of stack', plugin='std',
+             result_kind=RESULT_LIST),
     Operator(opcode='dup', arity=1, function=lambda x: [x, x],
-             description='duplicate topmost level of stack', plugin='std'),
+             description='duplicate topmost level of stack', plugin='std',
+             result_kind=RESULT_LIST),
 ]
 
 
+def _module_mtime(module):
+    """Return the modification time of the file a module was loaded from, or None."""
+    try:
+        return os.path.getmtime(module.__file__)
+    except (AttributeError, TypeError, OSError):
+        return None
+
+
+def _push_result(stack, res):
+    """
+    Push the result of a RESULT_ANY operator to stack.
+
+    Returns False, without changing stack, if res is an error message.
+    """
+    if res is None:
+        pass
+    elif isinstance(res, (int, float, complex)):
+        stack.append(res)
+    elif isinstance(res, list):
+        stack.extend(res)
+    else:  # error string
+        return False
+    return True
+
+
+def _push_checked(stack, res):
+    """
+    Push the result of a RESULT_CHECKED operator to stack.
+
+    Returns False, without changing stack, if res is an error message.
+    """
+    if isinstance(res, str):
+        return False
+    stack.append(res)
+    return True
+
+
+def _discard(stack, res):
+    """Ignore the result of a RESULT_NONE operator."""
+
+
+# How to push results for the kinds of operators that do not return error messages
+_store_result = {
+    RESULT_SCALAR: list.append,
+    RESULT_LIST: list.extend,
+    RESULT_NONE: _discard,
+}
+
+
+def _make_handler(op):
+    """
+    Build a function that runs operator op on a stack.
+
+    handler(stack) pops the arguments from stack and pushes the results,
+    returning None; or returns an error message leaving stack unchanged.
+    The handler is specialized for the arity of the operator, so that the
+    common unary and binary operators run without argument lists, and for
+    its result kind, so that results are only checked for error messages
+    when the operator may return one.
+    """
+    function, arity = op.function, op.arity
+    underflow = f"Not enough arguments for operator '{op.opcode}'"
+
+    store = _store_result.get(op.result_kind)
+    if store is not None:
+        if arity == 1:
+            def handler(stack):
+                if not stack:
+                    return underflow
+                store(stack, function(stack.pop()))
+                return None
+        elif arity == 2:
+            def handler(stack):
+                if len(stack) < 2:
+                    return underflow
+                y = stack.pop()
+                store(stack, function(stack.pop(), y))
+                return None
+        else:
+            def handler(stack):
+                if len(stack) < arity:
+                    return underflow
+                args = stack[len(stack) - arity:]
+                del stack[len(stack) - arity:]
+                store(stack, function(*args))
+                return None
+        return handler
+
+    push = _push_checked if op.result_kind == RESULT_CHECKED else _push_result
+    if arity == 1:
+        def handler(stack):
+            if not stack:
+                return underflow
+            x = stack.pop()
+            res = function(x)
+            if push(stack, res):
+                return None
+            stack.append(x)  # restore state before error
+            return res  # pass on error message
+    elif arity == 2:
+        def handler(stack):
+            if len(stack) < 2:
+                return underflow
+            y = stack.pop()
+            x = stack.pop()
+            res = function(x, y)
+            if push(stack, res):
+                return None
+            stack.append(x)  # restore state before error
+            stack.append(y)
+            return res  # pass on error message
+    else:
+        def handler(stack):
+            if len(stack) < arity:
+                return underflow
+            args = stack[len(stack) - arity:]
+            del stack[len(stack) - arity:]
+            res = function(*args)
+            if push(stack, res):
+                return None
+            stack.extend(args)  # restore state before error
+            return res  # pass on error message
+    return handler
+
+
 class RPNCalculator:
     """
     Implements an RPN calculator.
@@ -62,13 +211,33 @@ class RPNCalculator:
 
     def __init__(self):
         self.stack = []
-        self._operators = {op.opcode: op for op in _std_operators}
-   
+        self._operators = {sys.intern(op.opcode): op for op in _std_operators}
+        self._plugin_cache = {}  # plugin_name: (module file mtime, list of Operator)
+        self._operators_changed()
+
+    def _operators_changed(self):
+        """Rebuild or invalidate everything derived from the registered operators."""
+        self._handlers = {opcode: _make_handler(op) for opcode, op in self._operators.items()}
+        self._listing = None
+
     @property
     def operators(self):
         """Return an iterator over the registered operators as Operator instances."""
         return self._operators.values()
 
+    def render_operators(self):
+        """
+        Return a description of the registered operators as a string.
+
+        There is one line per operator, in the form
+        'opcode (arity): description [plugin]'. The text is cached until
+        the registered operators change.
+        """
+        if self._listing is None:
+            self._listing = '\n'.join(f'{op.opcode} ({op.arity}): {op.description} [{op.plugin}]'
+                                      for op in self._operators.values())
+        return self._listing
+
     def add_operator(self, operator):
         """
         Allows to add a new operator or update (redefine) an existing one.
@@ -77,7 +246,8 @@ class RPNCalculator:
         rpn_calc.Operator class. If the opcode is already defined, this will
         overwrite it.
         """
-        self._operators[operator.opcode] = operator
+        self._operators[sys.intern(operator.opcode)] = operator
+        self._operators_changed()
 
     def load_plugin(self, plugin_name):
         """
@@ -91,11 +261,22 @@ class RPNCalculator:
 
         A plugin containing an operator with an opcode that clashes with one
         that is already loaded will override it.
+
+        The processed operators are cached, so loading a plugin again is
+        cheap; if the plugin file was modified in the meantime, the module
+        is reloaded instead.
         """
-        exec(f'import {plugin_name} as plugin', globals())
-        for operator in plugin.operators:
-            op = Operator(**operator)
-            self._operators[op.opcode] = op
+        plugin = importlib.import_module(plugin_name)
+        mtime = _module_mtime(plugin)
+        cached_mtime, ops = self._plugin_cache.get(plugin_name, (None, None))
+        if ops is None or cached_mtime != mtime:
+            if ops is not None:  # the plugin file changed since it was processed
+                plugin = importlib.reload(plugin)
+            ops = [Operator(**operator) for operator in plugin.operators]
+            self._plugin_cache[plugin_name] = mtime, ops
+        for op in ops:
+            self._operators[sys.intern(op.opcode)] = op
+        self._operators_changed()
 
     def unload_plugin(self, plugin):
         """Unload a plugin"""
@@ -104,6 +285,7 @@ class RPNCalculator:
         plugin_ops = [opcode for opcode, op in self._operators.items() if op.plugin == plugin]
         for opcode in plugin_ops:
             self._operators.pop(opcode)
+        self._operators_changed()
 
     def run_command(self, cmd):
         """
@@ -116,24 +298,10 @@ class RPNCalculator:
             self.stack.append(cmd)
             return None
 
-        if cmd not in self._operators:
+        handler = self._handlers.get(cmd)
+        if handler is None:
             return f"Operator '{cmd}' undefined"
-
-        op = self._operators[cmd]
-        if len(self.stack) < op.arity:
-            return f"Not enough arguments for operator '{cmd}'"
-        self.stack, args = self.stack[:-op.arity], self.stack[-op.arity:]
-        res = op.function(*args)
-        if res is None:
-            pass
-        elif isinstance(res, (int, float, complex)):
-            self.stack.append(res)
-        elif isinstance(res, list):
-            self.stack.extend(res)
-        else: # error string
-            self.stack.extend(args)  # restore state before error
-            return res  # pass on error message
-        return None  # all happy paths end here
+        return handler(self.stack)
 
     def read_stack(self, n=None):
         """
@@ -143,6 +311,18 @@ class RPNCalculator:
         """
         return self.stack[-n:] if n is not None else self.stack[:]
 
+    def read_stack_view(self, n=None):
+        """
+        Get up to n elements from the stack, for reading only.
+
+        Same as read_stack, but the stack itself is returned instead of a
+        copy when all of it is requested, so the result must not be
+        modified, and it reflects any later changes to the stack.
+        """
+        if n is not None and n < len(self.stack):
+            return self.stack[-n:]
+        return self.stack
+
     def clear_stack(self):
         """Remove all elements from the stack"""
-        self.stack = []
+        self.stack.clear()